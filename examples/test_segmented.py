@@ -21,15 +21,17 @@
 This tests updating a namespace based on segmented content.
 """
 
+from __future__ import print_function
 import time
 from pyndn import Interest, Face
 from pycnl import Namespace, SegmentedObjectHandler
 
-def dump(*list):
-    result = ""
-    for element in list:
-        result += (element if type(element) is str else str(element)) + " "
-    print(result)
+# The range of the sleep time between calls to processEvents.
+MIN_SLEEP_SECONDS = 0.001
+MAX_SLEEP_SECONDS = 0.1
+
+def dump(*args):
+    print(*args, sep=" ")
 
 def main():
     # Silence the warning from Interest wire encode.
@@ -40,15 +42,28 @@ def main():
     page.setFace(face)
 
     enabled = [True]
+    # Set to True by a callback when processEvents did some work.
+    gotEvent = [False]
+    def onStateChanged(namespace, changedNamespace, state, callbackId):
+        gotEvent[0] = True
+    page.addOnStateChanged(onStateChanged)
+
     def onSegmentedObject(objectNamespace):
         dump("Got segmented object size", objectNamespace.obj.size())
         enabled[0] = False
     SegmentedObjectHandler(page, onSegmentedObject).objectNeeded()
 
     # Loop calling processEvents until a callback sets enabled[0] = False.
+    sleepSeconds = MIN_SLEEP_SECONDS
     while enabled[0]:
+        gotEvent[0] = False
         face.processEvents()
-        # We need to sleep for a few milliseconds so we don't use 100% of the CPU.
-        time.sleep(0.01)
+        # Sleep so we don't use 100% of the CPU. While segments are arriving,
+        # use a short sleep. When idle, back off up to MAX_SLEEP_SECONDS.
+        if gotEvent[0]:
+            sleepSeconds = MIN_SLEEP_SECONDS
+        else:
+            sleepSeconds = min(sleepSeconds * 2, MAX_SLEEP_SECONDS)
+        time.sleep(sleepSeconds)
 
 main()
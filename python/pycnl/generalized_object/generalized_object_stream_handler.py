@@ -26,11 +26,15 @@ fetch the _latest packet and use its name to fetch the generalized object.
 """
 
 import logging
+import random
+from functools import partial
 from pyndn import Name, MetaInfo, DelegationSet
 from pyndn.util.common import Common
 from pycnl.namespace import Namespace, NamespaceState
 from pycnl.generalized_object.generalized_object_handler import GeneralizedObjectHandler
 
+_logger = logging.getLogger(__name__)
+
 class GeneralizedObjectStreamHandler(Namespace.Handler):
     """
     Create a GeneralizedObjectHandler with the optional
@@ -63,6 +67,15 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
       attached and listen for the OBJECT_READY state.
     :type onSequencedGeneralizedObject: function object
     """
+    __slots__ = (
+      '_pipelineSize', '_onSequencedGeneralizedObject', '_latestNamespace',
+      '_namespaceNameSize', '_producedSequenceNumber',
+      '_latestPacketFreshnessPeriod', '_latestRetryPeriod',
+      '_latestRetryPending', '_latestContent',
+      '_latestContentSequenceNumber', '_latestDelegations',
+      '_generalizedObjectHandler', '_pendingSequenceNumbers',
+      '_maxRequestedSequenceNumber')
+
     def __init__(self, namespace = None, pipelineSize = 8,
           onSequencedGeneralizedObject = None):
         super(GeneralizedObjectStreamHandler, self).__init__()
@@ -72,13 +85,26 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
         self._pipelineSize = pipelineSize
         self._onSequencedGeneralizedObject = onSequencedGeneralizedObject
         self._latestNamespace = None
+        # The number of components in the name of the Handler's Namespace.
+        self._namespaceNameSize = 0
         self._producedSequenceNumber = -1
-        self._latestPacketFreshnessPeriod = 1000.0
+        self._latestPacketFreshnessPeriod = (
+          GeneralizedObjectStreamHandler._DEFAULT_LATEST_PACKET_FRESHNESS_PERIOD)
+        # The delay before fetching _latest again after a timeout or nack. This
+        # is updated by setLatestPacketFreshnessPeriod.
+        self._latestRetryPeriod = self._latestPacketFreshnessPeriod
+        # True if fetching the _latest packet again is already scheduled.
+        self._latestRetryPending = False
+        # The encoded DelegationSet for the _latest packet content, and the
+        # sequence number that it refers to.
+        self._latestContent = None
+        self._latestContentSequenceNumber = -1
+        # Reuse one DelegationSet to encode and decode the _latest content.
+        self._latestDelegations = DelegationSet()
         self._generalizedObjectHandler = GeneralizedObjectHandler()
-        self._nRequestedSequenceNumbers = 0
+        # The sequence numbers which are requested but not yet reported.
+        self._pendingSequenceNumbers = set()
         self._maxRequestedSequenceNumber = -1
-        self._nReportedSequenceNumbers = 0
-        self._maxReportedSequenceNumber = -1
 
         if namespace != None:
             self.setNamespace(namespace)
@@ -106,7 +132,7 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
 
         self._producedSequenceNumber = sequenceNumber
         sequenceNamespace = self.namespace[
-          Name.Component.fromSequenceNumber(self._producedSequenceNumber)]
+          self._getSequenceNumberComponent(self._producedSequenceNumber)]
         self._generalizedObjectHandler.setObject(
           sequenceNamespace, obj, contentType, other)
 
@@ -153,6 +179,13 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
         """
         self._latestPacketFreshnessPeriod = Common.nonNegativeFloatOrNone(
           latestPacketFreshnessPeriod)
+        # Compute the retry delay here instead of for each timeout. If the
+        # freshness period is None, use the default.
+        if self._latestPacketFreshnessPeriod != None:
+            self._latestRetryPeriod = self._latestPacketFreshnessPeriod
+        else:
+            self._latestRetryPeriod = (
+              GeneralizedObjectStreamHandler._DEFAULT_LATEST_PACKET_FRESHNESS_PERIOD)
 
     def getPipelineSize(self):
         """
@@ -209,6 +242,7 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
 
     def _onNamespaceSet(self):
         self._latestNamespace = self.namespace[self.NAME_COMPONENT_LATEST]
+        self._namespaceNameSize = self.namespace.name.size()
 
         self.namespace.addOnObjectNeeded(self._onObjectNeeded)
         self.namespace.addOnStateChanged(self._onStateChanged)
@@ -228,19 +262,29 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
 
         if (neededNamespace == self._latestNamespace and
               self._producedSequenceNumber >= 0):
-            # Produce the _latest Data packet.
-            sequenceName = Name(self.namespace.name).append(
-              Name.Component.fromSequenceNumber(self._producedSequenceNumber))
-            delegations = DelegationSet()
-            delegations.add(1, sequenceName)
-
+            # Produce the _latest Data packet. We don't need to cache it since
+            # Namespace answers Interests with a fresh _latest packet from the
+            # name tree, so we are only called when a new one is needed. The
+            # content only depends on the produced sequence number, so only
+            # encode it again if that changed.
+            if self._latestContentSequenceNumber != self._producedSequenceNumber:
+                sequenceName = Name(self.namespace.name).append(
+                  self._getSequenceNumberComponent(self._producedSequenceNumber))
+                delegations = self._latestDelegations
+                delegations.clear()
+                delegations.add(1, sequenceName)
+                self._latestContent = delegations.wireEncode()
+                self._latestContentSequenceNumber = self._producedSequenceNumber
+
+            # Each _latest Data packet needs a new version since an earlier
+            # one with the same content may be stale.
             versionedLatest = self._latestNamespace[Name.Component.fromVersion
               (Common.getNowMilliseconds())]
             metaInfo = MetaInfo()
             metaInfo.setFreshnessPeriod(self._latestPacketFreshnessPeriod)
             versionedLatest.setNewDataMetaInfo(metaInfo)
             # Make the Data packet and reply to outstanding Interests.
-            versionedLatest.serializeObject(delegations.wireEncode())
+            versionedLatest.serializeObject(self._latestContent)
 
             return True
 
@@ -248,52 +292,80 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
 
     def _onStateChanged(self, namespace, changedNamespace, state, callbackId):
         """
-        This is called when a packet arrives. Parse the _latest packet and start
-        fetching the stream of GeneralizedObject by sequence number.
+        This is called when a packet arrives. Call _onTimeoutOrNack or
+        _onObjectReady according to _STATE_HANDLERS, or ignore the state.
+        """
+        handler = GeneralizedObjectStreamHandler._STATE_HANDLERS.get(state)
+        if handler != None:
+            handler(self, changedNamespace)
+
+    def _onTimeoutOrNack(self, changedNamespace):
+        """
+        This is called for INTEREST_TIMEOUT or INTEREST_NETWORK_NACK. Fetch the
+        _latest packet again if needed.
         """
-        if (state == NamespaceState.INTEREST_TIMEOUT or
-             state == NamespaceState.INTEREST_NETWORK_NACK):
-            logging.getLogger(__name__).info(
+        # This is called for every timeout, so use local variables.
+        latestNamespace = self._latestNamespace
+        changedName = changedNamespace.name
+
+        if _logger.isEnabledFor(logging.INFO):
+            _logger.info(
               "GeneralizedObjectStreamHandler: Got timeout or nack for " +
-              changedNamespace.name.toUri())
-            if changedNamespace == self._latestNamespace:
-                # Timeout or network NACK, so try to fetch again.
-                self._latestNamespace._getFace().callLater(
-                  self._latestPacketFreshnessPeriod,
-                  lambda: self._latestNamespace.objectNeeded(True));
-                return
-            elif (self._pipelineSize > 0 and
-                  changedNamespace.name.size() == self.namespace.name.size() + 2 and
-                  changedNamespace.name[-1].equals(
-                    GeneralizedObjectHandler.NAME_COMPONENT_META) and
-                  changedNamespace.name[-2].isSequenceNumber() and
-                  changedNamespace.name[-2].toSequenceNumber() ==
-                    self._maxRequestedSequenceNumber):
+              changedName.toUri())
+        if changedNamespace == latestNamespace:
+            # Timeout or network NACK, so try to fetch again. Don't schedule
+            # another retry if one is pending, and add some jitter so that
+            # retries after a network problem are not synchronized.
+            if not self._latestRetryPending:
+                self._latestRetryPending = True
+                latestNamespace._getFace().callLater(
+                  self._latestRetryPeriod * random.uniform(0.9, 1.1),
+                  self._retryLatest)
+            return
+
+        if (self._pipelineSize > 0 and
+            changedName.size() == self._namespaceNameSize + 2):
+            # We know the size, so get the components by positive index.
+            sequenceComponent = changedName.get(self._namespaceNameSize)
+            if (changedName.get(self._namespaceNameSize + 1).equals(
+                  GeneralizedObjectHandler.NAME_COMPONENT_META) and
+                sequenceComponent.isSequenceNumber() and
+                sequenceComponent.toSequenceNumber() ==
+                  self._maxRequestedSequenceNumber):
                 # The highest pipelined request timed out, so request the _latest.
                 # TODO: Should we do this for the lowest requested?
-                logging.getLogger(__name__).info(
-                  "GeneralizedObjectStreamHandler: Requesting _latest because the highest pipelined request timed out: " +
-                  changedNamespace.name.toUri())
-                self._latestNamespace.objectNeeded(True)
-                return
+                if _logger.isEnabledFor(logging.INFO):
+                    _logger.info(
+                      "GeneralizedObjectStreamHandler: Requesting _latest because the highest pipelined request timed out: " +
+                      changedName.toUri())
+                latestNamespace.objectNeeded(True)
 
-        if (not (state == NamespaceState.OBJECT_READY and
-                 changedNamespace.name.size() ==
-                   self._latestNamespace.name.size() + 1 and
-                 self._latestNamespace.name.isPrefixOf(changedNamespace.name) and
-                 changedNamespace.name[-1].isVersion())):
+    def _onObjectReady(self, changedNamespace):
+        """
+        This is called for OBJECT_READY. If this is a versioned _latest packet,
+        parse it and start fetching the stream of GeneralizedObject by sequence
+        number.
+        """
+        latestNamespace = self._latestNamespace
+        changedName = changedNamespace.name
+
+        if (not (changedName.size() == self._namespaceNameSize + 2 and
+                 latestNamespace.name.isPrefixOf(changedName) and
+                 changedName[-1].isVersion())):
             # Not a versioned _latest, so ignore.
             return
 
         # Decode the _latest packet to get the target to fetch.
         # TODO: Should this already have been done by deserialize()?)
-        delegations = DelegationSet()
+        # wireDecode clears the DelegationSet before decoding.
+        delegations = self._latestDelegations
         delegations.wireDecode(changedNamespace.obj)
         if delegations.size() <= 0:
             return
         targetName = delegations.get(0).getName()
-        if (not (self.namespace.name.isPrefixOf(targetName) and
-                 targetName.size() == self.namespace.name.size() + 1 and
+        # Check the size first since it is cheaper than isPrefixOf.
+        if (not (targetName.size() == self._namespaceNameSize + 1 and
+                 self.namespace.name.isPrefixOf(targetName) and
                  targetName[-1].isSequenceNumber())):
             # TODO: Report an error for invalid target name?
             return
@@ -314,9 +386,12 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
                     sequenceMeta.objectNeeded()
             else:
                 # Fetch by continuously filling the Interest pipeline.
-                self._maxReportedSequenceNumber = sequenceNumber - 1
                 # Reset the pipeline in case we are resuming after a timeout.
-                self._nRequestedSequenceNumbers = self._nReportedSequenceNumbers
+                self._pendingSequenceNumbers.clear()
+                # Sequence numbers up to _maxRequestedSequenceNumber are
+                # already requested, so only skip ahead if the _latest is newer.
+                if sequenceNumber > self._maxRequestedSequenceNumber:
+                    self._maxRequestedSequenceNumber = sequenceNumber - 1
                 self._requestNewSequenceNumbers()
 
         if self._pipelineSize == 0:
@@ -325,58 +400,127 @@ class GeneralizedObjectStreamHandler(Namespace.Handler):
             if freshnessPeriod == None or freshnessPeriod < 0:
                 # No freshness period. We don't expect this.
                 return
-            self._latestNamespace._getFace().callLater(
-              freshnessPeriod / 2, lambda: self._latestNamespace.objectNeeded(True));
+            latestNamespace._getFace().callLater(
+              freshnessPeriod / 2, lambda: latestNamespace.objectNeeded(True));
 
-    def _requestNewSequenceNumbers(self):
+    def _retryLatest(self):
         """
-        Request new child sequence numbers, up to the pipelineSize_.
+        This is called by callLater after a timeout or network nack to fetch
+        the _latest packet again.
         """
-        nOutstandingSequenceNumbers = (self._nRequestedSequenceNumbers -
-          self._nReportedSequenceNumbers)
-
-        # Now find unrequested sequence numbers and request.
-        sequenceNumber = self._maxReportedSequenceNumber
-        while nOutstandingSequenceNumbers < self._pipelineSize:
-            sequenceNumber += 1
-            sequenceNamespace = self.namespace[
-              Name.Component.fromSequenceNumber(sequenceNumber)]
-            sequenceMeta = sequenceNamespace[
-              GeneralizedObjectHandler.NAME_COMPONENT_META]
-            if (sequenceMeta.data or
-                sequenceMeta.state >= NamespaceState.INTEREST_EXPRESSED):
-                # Already got the data packet or already requested.
-                continue
-
-            nOutstandingSequenceNumbers += 1
-            self._nRequestedSequenceNumbers += 1
+        self._latestRetryPending = False
+        self._latestNamespace.objectNeeded(True)
 
+    def _requestNewSequenceNumbers(self):
+        """
+        Request new child sequence numbers, up to the pipelineSize_. Requests
+        are made in order, so the sequence numbers after
+        _maxRequestedSequenceNumber have not been requested.
+        """
+        nNeeded = self._pipelineSize - len(self._pendingSequenceNumbers)
+        if nNeeded <= 0:
+            return
+        startSequenceNumber = self._maxRequestedSequenceNumber + 1
+        self._maxRequestedSequenceNumber = startSequenceNumber + nNeeded - 1
+
+        namespace = self.namespace
+        pendingSequenceNumbers = self._pendingSequenceNumbers
+        getSequenceNumberComponent = self._getSequenceNumberComponent
+        metaComponent = GeneralizedObjectHandler.NAME_COMPONENT_META
+
+        # First attach a handler to each new sequence number, then request them
+        # together.
+        sequenceMetas = []
+        for sequenceNumber in range(
+              startSequenceNumber, startSequenceNumber + nNeeded):
+            pendingSequenceNumbers.add(sequenceNumber)
+
+            sequenceNamespace = namespace[
+              getSequenceNumberComponent(sequenceNumber)]
             GeneralizedObjectHandler(sequenceNamespace,
               self._makeOnGeneralizedObject(sequenceNumber))
-            if sequenceNumber > self._maxRequestedSequenceNumber:
-                self._maxRequestedSequenceNumber = sequenceNumber
+            sequenceMetas.append(sequenceNamespace[metaComponent])
+
+        for sequenceMeta in sequenceMetas:
             sequenceMeta.objectNeeded()
 
     def _makeOnGeneralizedObject(self, sequenceNumber):
-        def onGeneralizedObject(contentMetaInfo, objectNamespace):
-            if self._onSequencedGeneralizedObject != None:
-                try:
-                    self._onSequencedGeneralizedObject(
-                      sequenceNumber, contentMetaInfo, objectNamespace)
-                except:
-                    logging.exception("Error in onSequencedGeneralizedObject")
-
-            self._nReportedSequenceNumbers += 1
-            if sequenceNumber > self._maxReportedSequenceNumber:
-                self._maxReportedSequenceNumber = sequenceNumber
-
-            if self._pipelineSize > 0:
-                # Continue to fetch by filling the pipeline.
-                self._requestNewSequenceNumbers()
+        """
+        Make the onGeneralizedObject callback to give to the
+        GeneralizedObjectHandler for the sequence number. If there is no
+        onSequencedGeneralizedObject callback, skip the wrapper which calls it.
+        """
+        if self._onSequencedGeneralizedObject != None:
+            return partial(self._onGeneralizedObject, sequenceNumber)
+        else:
+            return partial(self._onSequenceNumberReported, sequenceNumber)
+
+    def _onGeneralizedObject(self, sequenceNumber, contentMetaInfo,
+          objectNamespace):
+        """
+        Call the onSequencedGeneralizedObject callback, then
+        _onSequenceNumberReported.
+        """
+        try:
+            self._onSequencedGeneralizedObject(
+              sequenceNumber, contentMetaInfo, objectNamespace)
+        except:
+            logging.exception("Error in onSequencedGeneralizedObject")
 
-        return onGeneralizedObject
+        self._onSequenceNumberReported(
+          sequenceNumber, contentMetaInfo, objectNamespace)
+
+    def _onSequenceNumberReported(self, sequenceNumber, contentMetaInfo,
+          objectNamespace):
+        """
+        Update the pipeline after the generalized object for the sequence number
+        is received.
+        """
+        self._pendingSequenceNumbers.discard(sequenceNumber)
+
+        if self._pipelineSize > 0:
+            # Continue to fetch by filling the pipeline.
+            self._requestNewSequenceNumbers()
+
+    @staticmethod
+    def _getSequenceNumberComponent(sequenceNumber):
+        """
+        Get the sequence number name component, reusing a previously encoded
+        component if possible. A sequence number is typically encoded once when
+        it is requested and again when it is produced or reported, so this saves
+        re-encoding it.
+
+        :param int sequenceNumber: The sequence number.
+        :return: The sequence number name component. You must not modify it.
+        :rtype: Name.Component
+        """
+        components = GeneralizedObjectStreamHandler._sequenceNumberComponents
+        component = components.get(sequenceNumber)
+        if component == None:
+            if (len(components) >=
+                  GeneralizedObjectStreamHandler._MAX_SEQUENCE_NUMBER_COMPONENTS):
+                # Sequence numbers usually increase, so just start over.
+                components.clear()
+            component = Name.Component.fromSequenceNumber(sequenceNumber)
+            components[sequenceNumber] = component
+
+        return component
 
     NAME_COMPONENT_LATEST = Name.Component("_latest")
 
+    # The dictionary key is the NamespaceState. The value is the method for
+    # _onStateChanged to call. Ignore other states.
+    _STATE_HANDLERS = {
+      NamespaceState.INTEREST_TIMEOUT: _onTimeoutOrNack,
+      NamespaceState.INTEREST_NETWORK_NACK: _onTimeoutOrNack,
+      NamespaceState.OBJECT_READY: _onObjectReady
+    }
+
     producedSequenceNumber = property(getProducedSequenceNumber)
     latestPacketFreshnessPeriod = property(getLatestPacketFreshnessPeriod, setLatestPacketFreshnessPeriod)
+
+    # The dictionary key is the sequence number. The value is the Name.Component.
+    _sequenceNumberComponents = {}
+    _MAX_SEQUENCE_NUMBER_COMPONENTS = 2048
+    # The default _latest packet freshness period in milliseconds.
+    _DEFAULT_LATEST_PACKET_FRESHNESS_PERIOD = 1000.0
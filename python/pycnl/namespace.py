@@ -23,7 +23,7 @@ the name tree and related operations to manage it.
 """
 
 import bisect
-import threading
+import itertools
 import logging
 import time
 from pyndn import Name, Interest, Data, MetaInfo
@@ -44,24 +44,56 @@ class Namespace(object):
     :param KeyChain keyChain: (optional) The KeyChain for signing packets,
       if needed. You can also call setKeyChain().
     """
+    __slots__ = (
+      '_name', '_parent', '_root', '_ancestors', '_children', '_sortedChildrenKeys', '_state',
+      '_networkNack', '_validateState', '_validationError',
+      '_freshnessExpiryTimeMilliseconds', '_data', '_dataDescendantCount',
+      '_maxDescendantDataNameSize', '_object', '_face', '_cachedFace',
+      '_cachedFaceVersion', '_faceVersion', '_keyChain', '_newDataMetaInfo',
+      '_decryptor', '_decryptionError', '_signingError',
+      '_onStateChangedCallbacks', '_onStateChangedCallbackIds',
+      '_nRemovedOnStateChangedCallbackIds', '_onOwnStateChangedCallbackIds',
+      '_onValidateStateChangedCallbacks', '_onValidateStateChangedCallbackIds',
+      '_nRemovedOnValidateStateChangedCallbackIds',
+      '_onObjectNeededCallbacks', '_onDeserializeNeededCallbacks',
+      '_pendingIncomingInterestTable', '_fullPSync', '_maxInterestLifetime',
+      '_syncDepth')
+
     def __init__(self, name, keyChain = None):
         self._name = Name(name)
-        # _parent and _root may be updated by _createChild.
+        # _parent, _root and _ancestors may be updated by _createChild.
         self._parent = None
         self._root = self
+        # The tuple of parent nodes, starting with the root. A node's parent
+        # never changes, so this is set once in _createChild.
+        self._ancestors = ()
         # The dictionary key is a Name.Component. The value is the child Namespace.
         self._children = {}
-        # The keys of _children in sorted order, kept in sync with _children.
+        # The keys of _children in sorted order, or None if they were not needed
+        # yet. Once created, _createChild keeps this in sync with _children. Use
+        # _getSortedChildrenKeys() to create it if needed.
         # (We don't use OrderedDict because it doesn't sort keys on insert.)
-        self._sortedChildrenKeys = []
+        self._sortedChildrenKeys = None
         self._state = NamespaceState.NAME_EXISTS
         self._networkNack = None
         self._validateState = NamespaceValidateState.WAITING_FOR_DATA
         self._validationError = None
         self._freshnessExpiryTimeMilliseconds = None
         self._data = None
+        # The number of descendant nodes (not including this node) which have a
+        # Data packet. This is updated by setData.
+        self._dataDescendantCount = 0
+        # The largest name size of the descendant nodes with a Data packet, or 0
+        # if none. This is updated by setData.
+        self._maxDescendantDataNameSize = 0
         self._object = None
         self._face = None
+        # _getFace caches the Face from this or a parent node. The cache is valid
+        # if _cachedFaceVersion equals _faceVersion in the root node, which is
+        # incremented when setFace is called on any node.
+        self._cachedFace = None
+        self._cachedFaceVersion = -1
+        self._faceVersion = 0
         self._keyChain = keyChain
         self._newDataMetaInfo = None
         self._decryptor = None
@@ -69,8 +101,20 @@ class Namespace(object):
         self._signingError = ""
         # The dictionary key is the callback ID. The value is the onStateChanged function.
         self._onStateChangedCallbacks = {}
+        # The callback IDs of _onStateChangedCallbacks in the order they were
+        # added. This may still have IDs which were removed, which are counted
+        # by _nRemovedOnStateChangedCallbackIds.
+        self._onStateChangedCallbackIds = []
+        self._nRemovedOnStateChangedCallbackIds = 0
+        # The set of callback IDs in _onStateChangedCallbacks which are only
+        # called for a state change of this node, not of a descendant.
+        self._onOwnStateChangedCallbackIds = set()
         # The dictionary key is the callback ID. The value is the onValidateStateChanged function.
         self._onValidateStateChangedCallbacks = {}
+        # The callback IDs of _onValidateStateChangedCallbacks in the order they
+        # were added, like _onStateChangedCallbackIds.
+        self._onValidateStateChangedCallbackIds = []
+        self._nRemovedOnValidateStateChangedCallbackIds = 0
         # The dictionary key is the callback ID. The value is the onObjectNeeded function.
         self._onObjectNeededCallbacks = {}
         # The dictionary key is the callback ID. The value is the onDeserializetNeeded function.
@@ -84,6 +128,9 @@ class Namespace(object):
 
     class Handler(object):
         # Namespace,Handler is a base class for Handler classes.
+        # A subclass can define __slots__ for its own fields.
+        __slots__ = ('_namespace',)
+
         def __init__(self):
             self._namespace = None
 
@@ -250,27 +297,12 @@ class Namespace(object):
                 raise RuntimeError(
                   "The name of this node is not a prefix of the descendant name")
 
-            if descendantName.size() == self._name.size():
-                # A trivial case where it is already the name of this node.
-                return True
-
-            # Find the child node whose name equals the descendantName.
-            # We know descendantNamespace is a prefix, so we can just go by
-            # component count instead of a full compare.
-            descendantNamespace = self
-            while True:
-                nextComponent = descendantName[descendantNamespace._name.size()]
-                if not (nextComponent in descendantNamespace._children):
-                    return False
-
-                if descendantNamespace._name.size() + 1 == descendantName.size():
-                    # nextComponent is the final component.
-                    return True
-                descendantNamespace = descendantNamespace._children[nextComponent]
+            return self._findDescendant(descendantName) != None
         else:
             component = nameOrComponent
-            if not isinstance(component, Name.Component):
-                component = Name.Component(component)
+            # Checking the exact type is faster than isinstance.
+            if type(component) is not Name.Component:
+                component = Namespace._toComponent(component)
 
             return component in self._children
 
@@ -299,31 +331,53 @@ class Namespace(object):
                   "The name of this node is not a prefix of the descendant name")
 
             # Find or create the child node whose name equals the descendantName.
-            # We know descendantNamespace is a prefix, so we can just go by
-            # component count instead of a full compare.
-            descendantNamespace = self
-            while descendantNamespace._name.size() < descendantName.size():
-                nextComponent = descendantName[descendantNamespace._name.size()]
-                if nextComponent in descendantNamespace._children:
-                    descendantNamespace = descendantNamespace._children[nextComponent]
-                else:
-                    # Only fire the callbacks for the leaf node.
-                    isLeaf = (
-                      descendantNamespace._name.size() == descendantName.size() - 1)
-                    descendantNamespace = descendantNamespace._createChild(
-                      nextComponent, isLeaf)
-
-            return descendantNamespace
+            return self._findDescendant(descendantName, True)
         else:
             component = nameOrComponent
-            if not isinstance(component, Name.Component):
-                component = Name.Component(component)
+            # Checking the exact type is faster than isinstance.
+            if type(component) is not Name.Component:
+                component = Namespace._toComponent(component)
 
-            if component in self._children:
-                return self._children[component]
+            child = self._children.get(component)
+            if child != None:
+                return child
             else:
                 return self._createChild(component, True)
 
+    def bulkCreate(self, names):
+        """
+        Get or create the descendant node for each Name in names. This is the
+        same as calling getChild(name) for each name, except that the
+        OnStateChanged callbacks for the created nodes are only called after all
+        the nodes are created. As with getChild, this does not call the
+        callbacks for intermediate nodes.
+
+        :param names: The names of the descendant nodes. This Namespace node's
+          name must be a prefix of each.
+        :type names: list of Name
+        :return: A list of the descendant Namespace object for each Name in
+          names, in the same order.
+        :rtype: list of Namespace
+        :raises RuntimeError: If the name of this Namespace node is not a prefix
+          of one of the names.
+        """
+        # Check all the names first so that we don't create a partial tree.
+        for descendantName in names:
+            if not self._name.isPrefixOf(descendantName):
+                raise RuntimeError(
+                  "The name of this node is not a prefix of the descendant name")
+
+        # The nodes created as the leaf of a name, in the order created. Don't
+        # fire the callbacks until all nodes are created.
+        createdLeaves = []
+        result = [self._findDescendant(descendantName, True, createdLeaves)
+                  for descendantName in names]
+
+        for child in createdLeaves:
+            child._onCreated()
+
+        return result
+
     def getChildComponents(self):
         """
         Get a list of the name component of all child nodes.
@@ -332,7 +386,19 @@ class Namespace(object):
           This remains the same if child nodes are added or deleted.
         :rtype: list of Name.Component
         """
-        return self._sortedChildrenKeys[:]
+        return self._getSortedChildrenKeys()[:]
+
+    def _getSortedChildrenKeys(self):
+        """
+        Get the keys of _children in sorted order, sorting them the first time
+        they are needed. You must not modify the returned list.
+
+        :return: The sorted list of child name components.
+        :rtype: list of Name.Component
+        """
+        if self._sortedChildrenKeys == None:
+            self._sortedChildrenKeys = sorted(self._children)
+        return self._sortedChildrenKeys
 
     def serializeObject(self, obj):
         # TODO: What if this node already has a _data and/or _object?
@@ -398,7 +464,10 @@ class Namespace(object):
         if self._data != None:
             # We already have an attached object.
             return False
-        if not data.name.equals(self._name):
+        dataName = data.name
+        # The application may have used getChild(data.getName()), so first check
+        # if it is the same object.
+        if dataName is not self._name and not dataName.equals(self._name):
             raise RuntimeError(
               "The Data packet name does not equal the name of this Namespace node.")
 
@@ -415,6 +484,16 @@ class Namespace(object):
             self._freshnessExpiryTimeMilliseconds = None
         self._data = data
 
+        # Update the count so that _findBestMatchName can skip subtrees without
+        # Data packets.
+        size = self._name.size()
+        namespace = self._parent
+        while namespace != None:
+            namespace._dataDescendantCount += 1
+            if size > namespace._maxDescendantDataNameSize:
+                namespace._maxDescendantDataNameSize = size
+            namespace = namespace._parent
+
         return True
 
     def getData(self):
@@ -448,7 +527,7 @@ class Namespace(object):
             dataList.append(self._data)
 
         if len(self._children) > 0:
-            for child in self._sortedChildrenKeys:
+            for child in self._getSortedChildrenKeys():
                 self._children[child].getAllData(dataList)
 
     def getObject(self):
@@ -466,11 +545,11 @@ class Namespace(object):
         """
         return self._object
 
-    def addOnStateChanged(self, onStateChanged):
+    def addOnStateChanged(self, onStateChanged, includeDescendants = True):
         """
         Add an onStateChanged callback. When the state changes in this namespace
         at this node or any children, this calls onStateChanged as described
-        below.
+        below. (If includeDescendants is False, only call it for this node.)
 
         :param onStateChanged: This calls
           onStateChanged(namespace, changedNamespace, state, callbackId)
@@ -478,19 +557,27 @@ class Namespace(object):
           (possibly a child) whose state has changed, state is the new state as
           an int from the NamespaceState enum, and callbackId is the callback ID
           returned by this method. If you only care if the state has changed for
-          this Namespace (and not any of its children) then your callback can
-          check "if changedNamespace == namespace". (Note that the state given
-          to the callback may be different than changedNamespace.getState() if
-          other processing has changed the state before this callback is called.)
+          this Namespace (and not any of its children) then you can set
+          includeDescendants False, which is more efficient than having your
+          callback check "if changedNamespace == namespace". (Note that the
+          state given to the callback may be different than
+          changedNamespace.getState() if other processing has changed the state
+          before this callback is called.)
           NOTE: The library will log any exceptions raised by this callback, but
           for better error handling the callback should catch and properly
           handle any exceptions.
         :type onStateChanged: function object
+        :param bool includeDescendants: (optional) If True, call onStateChanged
+          when the state changes at this node or any children. If False, only
+          call it when the state of this node changes. If omitted, use True.
         :return: The callback ID which you can use in removeCallback().
         :rtype: int
         """
         callbackId = Namespace.getNextCallbackId()
         self._onStateChangedCallbacks[callbackId] = onStateChanged
+        self._onStateChangedCallbackIds.append(callbackId)
+        if not includeDescendants:
+            self._onOwnStateChangedCallbackIds.add(callbackId)
         return callbackId
 
     def addOnValidateStateChanged(self, onValidateStateChanged):
@@ -520,6 +607,7 @@ class Namespace(object):
         """
         callbackId = Namespace.getNextCallbackId()
         self._onValidateStateChangedCallbacks[callbackId] = onValidateStateChanged
+        self._onValidateStateChangedCallbackIds.append(callbackId)
         return callbackId
 
     def addOnObjectNeeded(self, onObjectNeeded):
@@ -557,8 +645,12 @@ class Namespace(object):
         :param int callbackId: The callback ID returned, for example, from
           addOnStateChanged.
         """
-        self._onStateChangedCallbacks.pop(callbackId, None)
-        self._onValidateStateChangedCallbacks.pop(callbackId, None)
+        if self._onStateChangedCallbacks.pop(callbackId, None) != None:
+            # _fireOnStateChanged will remove it from _onStateChangedCallbackIds.
+            self._nRemovedOnStateChangedCallbackIds += 1
+        self._onOwnStateChangedCallbackIds.discard(callbackId)
+        if self._onValidateStateChangedCallbacks.pop(callbackId, None) != None:
+            self._nRemovedOnValidateStateChangedCallbackIds += 1
 
     def setFace(self, face, onRegisterFailed = None, onRegisterSuccess = None):
         """
@@ -590,6 +682,8 @@ class Namespace(object):
           handle any exceptions.
         """
         self._face = face
+        # Invalidate the Face cached by _getFace in all nodes.
+        self._root._faceVersion += 1
 
         if onRegisterFailed != None:
             if self._root._pendingIncomingInterestTable == None:
@@ -760,13 +854,21 @@ class Namespace(object):
         :return: The Face, or None if not set on this or any parent.
         :rtype: Face
         """
+        faceVersion = self._root._faceVersion
+        if self._cachedFaceVersion == faceVersion:
+            return self._cachedFace
+
+        face = None
         namespace = self
         while namespace != None:
             if namespace._face != None:
-                return namespace._face
+                face = namespace._face
+                break
             namespace = namespace._parent
 
-        return None
+        self._cachedFace = face
+        self._cachedFaceVersion = faceVersion
+        return face
 
     def _getDecryptor(self):
         """
@@ -877,6 +979,82 @@ class Namespace(object):
             raise ValueError("Namespace[] does not support slices.")
         return self.getChild(key)
 
+    def _findDescendant(self, descendantName, create = False,
+                        createdLeaves = None):
+        """
+        Find the descendant node with the given name, optionally creating it.
+
+        :param Name descendantName: The name of the descendant node. This
+          Namespace node's name must be a prefix of it.
+        :param bool create: (optional) If True, create missing nodes, calling
+          the callbacks only for the leaf node as described by getChild. If
+          False or omitted, don't create nodes.
+        :param list createdLeaves: (optional) If create is True and this is a
+          list, don't call the callbacks for a created leaf node, but append it
+          to this list so that the caller can call its _onCreated later. This
+          also drops the sorted children keys of each parent which gets a new
+          child so that the parent sorts its keys once when they are needed. If
+          omitted, call the callbacks when creating the leaf node.
+        :return: The descendant Namespace object, or None if it doesn't exist
+          and create is False. If descendantName equals the name of this
+          Namespace, then return this Namespace.
+        :rtype: Namespace
+        """
+        # We know descendantNamespace is a prefix, so we can just go by
+        # component count instead of a full compare.
+        # Each step down adds one component, so keep the sizes in locals.
+        descendantNamespace = self
+        size = self._name.size()
+        descendantNameSize = descendantName.size()
+        while size < descendantNameSize:
+            nextComponent = descendantName.get(size)
+            child = descendantNamespace._children.get(nextComponent)
+            if child == None:
+                if not create:
+                    return None
+
+                # Only fire the callbacks for the leaf node.
+                isLeaf = (size == descendantNameSize - 1)
+                if createdLeaves != None:
+                    descendantNamespace._sortedChildrenKeys = None
+                    child = descendantNamespace._createChild(nextComponent, False)
+                    if isLeaf:
+                        createdLeaves.append(child)
+                else:
+                    child = descendantNamespace._createChild(nextComponent, isLeaf)
+
+            descendantNamespace = child
+            size += 1
+
+        return descendantNamespace
+
+    @staticmethod
+    def _toComponent(value):
+        """
+        Convert the value to a Name.Component, reusing a previously converted
+        component if the value is a str or bytes. An application often looks
+        up children by the same string, so this saves re-creating the component.
+
+        :param value: The value for the Name.Component constructor.
+        :return: The name component. You must not modify it.
+        :rtype: Name.Component
+        """
+        valueType = type(value)
+        # Only cache immutable types whose equal values make equal components.
+        if not (valueType is str or valueType is bytes):
+            return Name.Component(value)
+
+        components = Namespace._components
+        component = components.get(value)
+        if component == None:
+            if len(components) >= Namespace._MAX_COMPONENTS:
+                # Don't let the cache grow without limit.
+                components.clear()
+            component = Name.Component(value)
+            components[value] = component
+
+        return component
+
     def _createChild(self, component, fireCallbacks):
         """
         Create the child with the given name component and add it to this
@@ -895,28 +1073,38 @@ class Namespace(object):
         child = Namespace(Name(self._name).append(component))
         child._parent = self
         child._root = self._root
+        child._ancestors = self._ancestors + (self,)
         self._children[component] = child
 
-        # Keep _sortedChildrenKeys synced with _children.
-        bisect.insort(self._sortedChildrenKeys, component)
+        # If the sorted keys are not needed yet, sort them later when they are.
+        if self._sortedChildrenKeys != None:
+            bisect.insort(self._sortedChildrenKeys, component)
 
         if fireCallbacks:
-            child._setState(NamespaceState.NAME_EXISTS)
+            child._onCreated()
+
+        return child
 
-            # Sync this name under the same conditions that we report a NAME_EXISTS.
-            if self._root._fullPSync:
-                syncNode = child._getSyncNode()
-                if syncNode != None:
-                    # Only sync names to the specified depth.
-                    depth = child._name.size() - syncNode._name.size()
+    def _onCreated(self):
+        """
+        Set the state of this newly created node to NamespaceState.NAME_EXISTS,
+        which fires OnStateChanged callbacks for this and all parent nodes, and
+        publish the name to PSync if needed.
+        """
+        self._setState(NamespaceState.NAME_EXISTS)
 
-                    if depth <= syncNode._syncDepth:
-                        # If _createChild is called when onNamesUpdate receives
-                        # a name from _fullPSync, then publishName already has
-                        # it and will ignore it.
-                        self._root._fullPSync.publishName(child._name)
+        # Sync this name under the same conditions that we report a NAME_EXISTS.
+        if self._root._fullPSync:
+            syncNode = self._getSyncNode()
+            if syncNode != None:
+                # Only sync names to the specified depth.
+                depth = self._name.size() - syncNode._name.size()
 
-        return child
+                if depth <= syncNode._syncDepth:
+                    # If _createChild is called when onNamesUpdate receives
+                    # a name from _fullPSync, then publishName already has
+                    # it and will ignore it.
+                    self._root._fullPSync.publishName(self._name)
 
     def _setState(self, state):
         """
@@ -928,20 +1116,35 @@ class Namespace(object):
         """
         self._state = state
 
-        # Fire callbacks.
-        namespace = self
-        while namespace != None:
+        # Fire callbacks for this node, then the parents up to the root.
+        self._fireOnStateChanged(self, state)
+        for namespace in reversed(self._ancestors):
             namespace._fireOnStateChanged(self, state)
-            namespace = namespace._parent
 
     def _fireOnStateChanged(self, changedNamespace, state):
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onStateChangedCallbacks.keys()):
+        callbacks = self._onStateChangedCallbacks
+        ids = self._onStateChangedCallbackIds
+        if self._nRemovedOnStateChangedCallbackIds > len(ids) // 2:
+            # Remove the IDs of removed callbacks. Make a new list since an
+            # outer call may still be iterating the old one.
+            ids = [id for id in ids if id in callbacks]
+            self._onStateChangedCallbackIds = ids
+            self._nRemovedOnStateChangedCallbackIds = 0
+
+        # If a descendant changed, skip the callbacks only for this node.
+        ownIds = self._onOwnStateChangedCallbackIds
+        if changedNamespace is self or len(ownIds) == 0:
+            ownIds = None
+
+        # Instead of copying the keys, only iterate the IDs which exist now.
+        # Callbacks added by a callback are appended after these.
+        for i in range(len(ids)):
+            id = ids[i]
             # A callback on a previous pass may have removed this callback, so check.
-            if id in self._onStateChangedCallbacks:
+            callback = callbacks.get(id)
+            if callback != None and (ownIds == None or id not in ownIds):
                 try:
-                    self._onStateChangedCallbacks[id](
-                      self, changedNamespace, state, id)
+                    callback(self, changedNamespace, state, id)
                 except:
                     logging.exception("Error in onStateChanged")
 
@@ -957,20 +1160,29 @@ class Namespace(object):
         """
         self._validateState = validateState
 
-        # Fire callbacks.
-        namespace = self
-        while namespace != None:
+        # Fire callbacks for this node, then the parents up to the root.
+        self._fireOnValidateStateChanged(self, validateState)
+        for namespace in reversed(self._ancestors):
             namespace._fireOnValidateStateChanged(self, validateState)
-            namespace = namespace._parent
 
     def _fireOnValidateStateChanged(self, changedNamespace, validateState):
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onValidateStateChangedCallbacks.keys()):
+        callbacks = self._onValidateStateChangedCallbacks
+        ids = self._onValidateStateChangedCallbackIds
+        if self._nRemovedOnValidateStateChangedCallbackIds > len(ids) // 2:
+            # Remove the IDs of removed callbacks. Make a new list since an
+            # outer call may still be iterating the old one.
+            ids = [id for id in ids if id in callbacks]
+            self._onValidateStateChangedCallbackIds = ids
+            self._nRemovedOnValidateStateChangedCallbackIds = 0
+
+        # As in _fireOnStateChanged, only iterate the IDs which exist now.
+        for i in range(len(ids)):
+            id = ids[i]
             # A callback on a previous pass may have removed this callback, so check.
-            if id in self._onValidateStateChangedCallbacks:
+            callback = callbacks.get(id)
+            if callback != None:
                 try:
-                    self._onValidateStateChangedCallbacks[id](
-                      self, changedNamespace, validateState, id)
+                    callback(self, changedNamespace, validateState, id)
                 except:
                     logging.exception("Error in onValidateStateChanged")
 
@@ -1041,19 +1253,27 @@ class Namespace(object):
             # Strip the implicit digest.
             interestName = interestName.getPrefix(-1)
 
-        if not self._name.isPrefixOf(interestName):
+        if (interestName.size() < self._name.size() or
+            not self._name.isPrefixOf(interestName)):
             # No match.
             return
 
-        # Check if the Namespace node exists and has a matching Data packet.
-        interestNamespace = self.getChild(interestName)
-        if self.hasChild(interestName):
-            bestMatch = Namespace._findBestMatchName(
-              interestNamespace, interest, Common.getNowMilliseconds())
-            if bestMatch != None:
-                # _findBestMatchName makes sure there is a _data packet.
-                face.putData(bestMatch._data)
-                return
+        # Usually the Namespace node already exists, so first look it up
+        # without the overhead of getChild.
+        interestNamespace = self._findDescendant(interestName)
+        if interestNamespace == None:
+            # Create the node so that callbacks can produce it. This fires the
+            # OnStateChanged callbacks which may already attach a Data packet,
+            # so search even for a new node.
+            interestNamespace = self.getChild(interestName)
+
+        # Check if the Namespace node has a matching Data packet.
+        bestMatch = Namespace._findBestMatchName(
+          interestNamespace, interest, Common.getNowMilliseconds())
+        if bestMatch != None:
+            # _findBestMatchName makes sure there is a _data packet.
+            face.putData(bestMatch._data)
+            return
 
         # No Data packet found, so save the pending Interest.
         self._root._pendingIncomingInterestTable.add(interest, face)
@@ -1082,34 +1302,61 @@ class Namespace(object):
         :rtype: Namespace
         """
         bestMatch = None
+        bestMatchSize = -1
+        mustBeFresh = interest.getMustBeFresh()
+        matchesData = interest.matchesData
+        # We can stop searching if we find a match with this size.
+        if namespace._dataDescendantCount > 0:
+            maxMatchSize = namespace._maxDescendantDataNameSize
+        else:
+            maxMatchSize = namespace._name.size()
+
+        # Use a stack instead of recursion. Push the children backwards so that
+        # they are visited in sorted order. A match must be longer than the
+        # best match so far, which results in a "less than" name among names
+        # of the same length. (A descendant match is always longer than a match
+        # at its ancestor.)
+        # Use local variables for attributes used in the loop.
+        stack = [namespace]
+        pop = stack.pop
+        push = stack.append
+        while len(stack) > 0:
+            namespace = pop()
+            if namespace._dataDescendantCount > 0:
+                if namespace._maxDescendantDataNameSize <= bestMatchSize:
+                    # Nothing in this subtree can be a better match.
+                    continue
+
+                children = namespace._children
+                for component in reversed(namespace._getSortedChildrenKeys()):
+                    child = children[component]
+                    if child._data != None or child._dataDescendantCount > 0:
+                        push(child)
+                    # Otherwise, skip the subtree since it has no Data packets.
+
+            data = namespace._data
+            if data == None:
+                continue
+            size = namespace._name.size()
+            if size <= bestMatchSize:
+                # This can't be a better match.
+                continue
 
-        # Search the children backwards which will result in a "less than" name
-        # among names of the same length.
-        for i in range(len(namespace._sortedChildrenKeys) - 1, -1, -1):
-            child = namespace._children[namespace._sortedChildrenKeys[i]]
-            childBestMatch = Namespace._findBestMatchName(
-              child, interest, nowMilliseconds)
-
-            if (childBestMatch != None and
-                (bestMatch == None or
-                 childBestMatch.name.size() >= bestMatch.name.size())):
-                bestMatch = childBestMatch
-
-        if bestMatch != None:
-            # We have a child match, and it is longer than this name, so return it.
-            return bestMatch
-
-        if (interest.getMustBeFresh() and
-            namespace._freshnessExpiryTimeMilliseconds != None and
-            nowMilliseconds >= namespace._freshnessExpiryTimeMilliseconds):
-            # The Data packet is no longer fresh.
-            # Debug: When to set the state to OBJECT_READY_BUT_STALE?
-            return None
+            if (mustBeFresh and
+                namespace._freshnessExpiryTimeMilliseconds != None and
+                nowMilliseconds >= namespace._freshnessExpiryTimeMilliseconds):
+                # The Data packet is no longer fresh.
+                # Debug: When to set the state to OBJECT_READY_BUT_STALE?
+                continue
 
-        if namespace._data != None and interest.matchesData(namespace._data):
-            return namespace
+            if matchesData(data):
+                bestMatch = namespace
+                bestMatchSize = size
+                if bestMatchSize == maxMatchSize:
+                    # There can't be a longer match.
+                    break
 
-        return None
+        return bestMatch
 
     def _onData(self, interest, data):
         startSeconds = time.clock()
@@ -1152,16 +1399,15 @@ class Namespace(object):
     @staticmethod
     def getNextCallbackId():
         """
-        Get the next unique callback ID. This uses a threading.Lock() to be
-        thread safe. This is an internal method only meant to be called by
-        library classes; the application should not call it.
+        Get the next unique callback ID. This uses itertools.count, whose next()
+        is atomic under the global interpreter lock, to be thread safe. This is
+        an internal method only meant to be called by library classes; the
+        application should not call it.
 
         :return: The next callback ID.
         :rtype: int
         """
-        with Namespace._lastCallbackIdLock:
-            Namespace._lastCallbackId += 1
-            return Namespace._lastCallbackId
+        return next(Namespace._callbackIdCounter)
 
     def _onNamesUpdate(self, names):
         """
@@ -1193,8 +1439,10 @@ class Namespace(object):
     # object is a special Python term, so use obj .
     obj = property(getObject)
 
-    _lastCallbackId = 0
-    _lastCallbackIdLock = threading.Lock()
+    _callbackIdCounter = itertools.count(1)
+    # The key is a str or bytes value. The value is the Name.Component.
+    _components = {}
+    _MAX_COMPONENTS = 4096
 
 class NamespaceState(object):
     """